@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 # Copyright 2017 Google LLC
 #
@@ -22,16 +22,24 @@ Can be used on the command line by specifying a command and optional values for
 > python greendo.py light off
 > python greendo.py status door
 
+To avoid logging in for every command, start a daemon that keeps one session open; later
+commands are sent to it over a Unix socket whenever it is running:
+
+> python greendo.py --daemon
+
 See help for more details.
 """
 
-from __future__ import print_function, division
-
 import argparse
-import cookielib
+import concurrent.futures
+import io
 import json
+import os
+import select
+import socket
+import stat
 import sys
-import urllib2
+import urllib3
 import websocket
 
 from getpass import getpass
@@ -39,6 +47,27 @@ from pprint import pprint, pformat
 from collections import namedtuple
 from contextlib import closing
 
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+def _dumps(obj):
+    """Serialize obj to compact JSON bytes, using orjson when it is available."""
+    s = _json.dumps(obj)
+    if isinstance(s, bytes):
+        return s
+    return s.encode("utf-8")
+
+def _clamp(v, lo, hi):
+    """Convert v to an int and limit it to the range [lo, hi]. A hi of None means no upper bound."""
+    v = int(v)
+    if v < lo:
+        return lo
+    if hi is not None and v > hi:
+        return hi
+    return v
+
 class _Response(namedtuple("_Response", "code error data raw")):
     """Holds useful data from web responses, making it easier to detect errors, etc.
 
@@ -50,11 +79,12 @@ class _Response(namedtuple("_Response", "code error data raw")):
     """
     @classmethod
     def from_url_resp(cls, resp):
-        raw = resp.read()
+        raw = resp.data
         data = {}
         if raw:
-            data = json.loads(raw)
-        code = resp.getcode()
+            # Both orjson and json accept bytes, so skip decoding.
+            data = _json.loads(raw)
+        code = resp.status
         if code != 200:
             return cls(code=code, error=code, data=data, raw=raw)
         if data.get("err") is not None:
@@ -72,6 +102,9 @@ class Session(namedtuple("Session", "api_key data")):
         data: The deserialized JSON response.
     """
 
+# Shared stand-in for missing attribute data. Never mutate it.
+_EMPTY = {}
+
 class _Attr(object):
     """An attribute item, taken from device details.
 
@@ -82,6 +115,8 @@ class _Attr(object):
         key: The key in the device attributes map.
         data: The data for this attribute.
     """
+    __slots__ = ("key", "data")
+
     def __init__(self, key, data):
         self.key = key
         self.data = data
@@ -104,29 +139,43 @@ class _Attr(object):
                 return None
         return val
 
+    def _v(self, key):
+        """Return data[key]["value"], or None. A fast path for the common two-level maybe."""
+        d = self.data
+        if d is None:
+            return None
+        attr = d.get(key)
+        if attr is None:
+            return None
+        return attr.get("value")
+
     def valid(self):
         """Indicate whether this object has any data."""
         return self.data is not None
 
 class _Module(_Attr):
     """A GDO module, like the light, fan, etc."""
+    __slots__ = ()
 
     def port(self):
         """Return the port ID for use with web socket commands."""
-        return self.maybe("portId", "value")
+        return self._v("portId")
 
     def module(self):
         """Return the module ID for use with web socket commands."""
-        return self.maybe("moduleId", "value")
+        return self._v("moduleId")
 
 class _Charger(_Module):
     """A charger module, used for getting battery level."""
+    __slots__ = ()
+
     def level(self):
         """Returns the charge level as an integer from 0 to 100."""
-        return self.maybe("chargeLevel", "value")
+        return self._v("chargeLevel")
 
 class _Door(_Module):
     """A door module, used to get status about position, state, etc."""
+    __slots__ = ()
 
     OPENING = "opening"
     CLOSING = "closing"
@@ -138,80 +187,114 @@ class _Door(_Module):
 
     def max_pos(self):
         """Returns the maximum door position in some units (inches?)."""
-        return self.maybe("maxDoorPosition", "value")
+        return self._v("maxDoorPosition")
 
     def preset_pos(self):
         """Returns the current position in some units (inches?)."""
-        return self.maybe("presetPosition", "value")
+        return self._v("presetPosition")
 
     def alarm(self):
         """Returns the alarm state of the door."""
-        return self.maybe("alarmState", "value")
+        return self._v("alarmState")
 
     def motor(self):
         """Returns the motor status of the door."""
-        return self.maybe("motorStatus", "value")
+        return self._v("motorStatus")
 
     def motion(self):
         """Returns the state of the motion sensor (on or off)."""
-        return self.maybe("motionSensor", "value")
+        return self._v("motionSensor")
 
     def sensor(self):
         """Returns the state of the safety sensors."""
-        return self.maybe("sensorFlag", "value")
+        return self._v("sensorFlag")
 
     def vacation(self):
         """Indicates whether vacation mode is on."""
-        return self.maybe("vacationMode", "value")
+        return self._v("vacationMode")
 
     def door_status(self):
         """Returns the status of the door (opening, closing, open, closed)."""
-        state = self.maybe("doorState", "value")
-        if state == 0:
-            return self.CLOSED
-        elif state == 1:
-            return self.OPEN
-        elif state == 2:
-            return self.CLOSING
-        else:
-            return self.OPENING
+        return _decode_door_state(self._v("doorState"))
 
     def door_error(self):
         """Returns the type of error last encountered, if any."""
-        mode = self.maybe("opMode", "value")
-        if mode == 0:
-            return None
-        elif mode == 1:
-            return self.ERROR
-        elif mode == 2:
-            return self.LOCKED
+        return _decode_door_error(self._v("opMode"))
 
     def door_max(self):
         """Returns the maximum position of the door in some units (inches?)."""
-        return self.maybe("maxDoorPosition", "value")
+        return self._v("maxDoorPosition")
 
     def door_pos(self):
         """Returns the position of the door in some units (inches?)."""
-        m = self.door_max()
-        return self.maybe("doorPosition", "value")
+        return self._v("doorPosition")
+
+    def _snapshot(self):
+        """Returns all door status fields as a dict, reading the data in a single pass."""
+        g = (self.data or _EMPTY).get
+        return {
+            "status": _decode_door_state((g("doorState") or _EMPTY).get("value")),
+            "error": _decode_door_error((g("opMode") or _EMPTY).get("value")),
+            "pos": (g("doorPosition") or _EMPTY).get("value"),
+            "max": (g("maxDoorPosition") or _EMPTY).get("value"),
+            "preset": (g("presetPosition") or _EMPTY).get("value"),
+            "motion": (g("motionSensor") or _EMPTY).get("value"),
+            "alarm": (g("alarmState") or _EMPTY).get("value"),
+            "motor": (g("motorStatus") or _EMPTY).get("value"),
+            "sensor": (g("sensorFlag") or _EMPTY).get("value"),
+            "vacation": (g("vacationMode") or _EMPTY).get("value"),
+        }
 
 class _Fan(_Module):
     """A fan module, used for getting the speed."""
+    __slots__ = ()
 
     def speed(self):
         """Return the speed in an integer from 0 to 100."""
-        return self.maybe("speed", "value")
+        return self._v("speed")
 
 class _Light(_Module):
     """A light module, used for getting state and timing."""
+    __slots__ = ()
 
     def on(self):
         """Indicates whether the light is on."""
-        return self.maybe("lightState", "value")
+        return self._v("lightState")
 
     def timer(self):
         """Returns the auto-off delay in minutes."""
-        return self.maybe("lightTimer", "value")
+        return self._v("lightTimer")
+
+# Door status strings, indexed by the doorState value.
+_DOOR_STATES = (_Door.CLOSED, _Door.OPEN, _Door.CLOSING, _Door.OPENING)
+
+# Door error strings, indexed by the opMode value.
+_DOOR_ERRORS = (None, _Door.ERROR, _Door.LOCKED)
+
+def _decode_door_state(state):
+    """Translate a doorState value to a status string. Unknown values mean opening."""
+    if not isinstance(state, int) or not 0 <= state < len(_DOOR_STATES):
+        return _Door.OPENING
+    return _DOOR_STATES[state]
+
+def _decode_door_error(mode):
+    """Translate an opMode value to an error string, or None if there is no known error."""
+    if not isinstance(mode, int) or not 0 <= mode < len(_DOOR_ERRORS):
+        return None
+    return _DOOR_ERRORS[mode]
+
+# Start of a gdoModuleCommand request, up to the moduleMsg value, which is followed by "}}".
+_MODULE_CMD_PREFIX = (b'{"jsonrpc":"2.0","method":"gdoModuleCommand","params":'
+                      b'{"msgType":16,"moduleType":%s,"portId":%s,"topic":%s,"moduleMsg":')
+
+# Maps the attribute key prefix (before "_<port>") to the Device field and module class.
+_MODULE_TYPES = {
+    "backupCharger": ("charger", _Charger),
+    "garageDoor": ("door", _Door),
+    "fan": ("fan", _Fan),
+    "wifiModule": ("wifi", _Module),
+    "garageLight": ("light", _Light),
+}
 
 class Device(object):
     """A device, meaning the complete garage door opener unit with all its stuff.
@@ -226,6 +309,7 @@ class Device(object):
         wifi: The wifi module.
         light: The light module.
     """
+    __slots__ = ("meta", "data", "charger", "door", "master", "fan", "wifi", "light", "_cmd_prefix")
 
     def __init__(self, meta, data):
         self.meta = meta
@@ -238,36 +322,30 @@ class Device(object):
         self.wifi = None
         self.light = None
 
-        for k, v in self.data["attributes"].iteritems():
-            if k == "masterUnit":
-                self.master = _Attr(k, v)
-            elif k.startswith("backupCharger_"):
-                self.charger = _Charger(k, v)
-            elif k.startswith("garageDoor_"):
-                self.door = _Door(k, v)
-            elif k.startswith("fan_"):
-                self.fan = _Fan(k, v)
-            elif k.startswith("wifiModule_"):
-                self.wifi = _Module(k, v)
-            elif k.startswith("garageLight_"):
-                self.light = _Light(k, v)
+        # Bound once here rather than looked up for every attribute.
+        module_type = _MODULE_TYPES.get
+        attr_cls = _Attr
+        for k, v in self.data["attributes"].items():
+            prefix, sep, _ = k.partition("_")
+            slot = module_type(prefix) if sep else None
+            if slot:
+                setattr(self, slot[0], slot[1](k, v))
+            elif k == "masterUnit":
+                self.master = attr_cls(k, v)
             else:
                 # Not fatal, just something we haven't encountered.
                 print("Unknown module key {!r}".format(k))
 
+        # Serialized command envelopes, keyed by module key, so commands only encode their message.
+        self._cmd_prefix = {}
+        for m in (self.charger, self.door, self.fan, self.wifi, self.light):
+            if m is not None:
+                self._cmd_prefix[m.key] = _MODULE_CMD_PREFIX % (
+                    _dumps(m.module()), _dumps(m.port()), _dumps(self.id))
+
     def _module_cmd_payload(self, module, msg):
-        """Generate a command payload for sending mutation commands to the web socket."""
-        return {
-            "jsonrpc": "2.0",
-            "method": "gdoModuleCommand",
-            "params": {
-                "msgType": 16,
-                "moduleType": module.module(),
-                "portId": module.port(),
-                "topic": self.id,
-                "moduleMsg": msg,
-            }
-        }
+        """Generate a serialized command payload for sending mutation commands to the web socket."""
+        return self._cmd_prefix[module.key] + _dumps(msg) + b"}}"
 
     @property
     def id(self):
@@ -294,8 +372,9 @@ class Device(object):
         })
 
     def cmd_preset_pos(self, pos):
+        """Set the preset position. The caller must keep pos within [0, door.max_pos()]."""
         return self._module_cmd_payload(self.door, {
-            "presetPosition": max(0, min(self.door.max_pos(), int(pos)))
+            "presetPosition": int(pos),
         })
 
     def cmd_light(self, on):
@@ -309,7 +388,7 @@ class Device(object):
         })
 
     def cmd_vacation(self, on):
-        return self._module_cmd_payload(self.vacation, {
+        return self._module_cmd_payload(self.door, {
             "vacationMode": bool(on),
         })
 
@@ -319,8 +398,9 @@ class Device(object):
         })
 
     def cmd_fan(self, speed):
+        """Set the fan speed. The caller must keep speed within [0, 100]."""
         return self._module_cmd_payload(self.fan, {
-            "speed": min(100, max(0, int(speed))),
+            "speed": int(speed),
         })
 
 class ResponseError(Exception):
@@ -331,6 +411,10 @@ class ResponseError(Exception):
         self.data = data
         super(ResponseError, self).__init__("{}: {!r}".format(reason, data))
 
+# Web socket authentication request, filled in with the JSON-encoded username and api key.
+_WS_AUTH_TEMPLATE = (b'{"jsonrpc":"2.0","id":3,"method":"srvWebSocketAuth",'
+                     b'"params":{"varName":%s,"apiKey":%s}}')
+
 class Client(object):
     """A client for talking to the GDO.
 
@@ -340,38 +424,35 @@ class Client(object):
         devices: A list of all Device objects known to the server.
     """
 
-    API_URL_PREFIX = "https://tti.tiwiconnect.com/api"
-    API_URL_SOCKET = "wss://tti.tiwiconnect.com/api/wsrpc"
+    API_HOST = "tti.tiwiconnect.com"
+    API_PATH_PREFIX = "/api"
+    API_URL_PREFIX = "https://" + API_HOST + API_PATH_PREFIX
+    API_URL_SOCKET = "wss://" + API_HOST + API_PATH_PREFIX + "/wsrpc"
+
+    # Upper bound on concurrent HTTPS requests, used for both the pool and device fetches.
+    MAX_CONNECTIONS = 8
+
+    # Seconds to wait on the web socket before giving up.
+    SOCKET_TIMEOUT = 30
 
     def __init__(self, username, password):
-        self._cookie_jar = cookielib.CookieJar()
-        self._opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self._cookie_jar))
+        # The session cookie from login, sent as-is with every later request.
+        self._cookie_header = None
+        # A single keep-alive pool, so login, device listing, and device details share one TLS session.
+        self._pool = urllib3.HTTPSConnectionPool(self.API_HOST, maxsize=self.MAX_CONNECTIONS, block=False)
 
         self.username = username
         self.session = self._login(username, password)
-        self.devices = self._devices()
-
-        self.master = None
-        for d in self.devices:
-            if d.master is not None:
-                self.master = d.master
-                break
-
-        if not self.master:
-            raise ValueError("couldn't find master unit")
-
-        self.ws = websocket.create_connection(self.API_URL_SOCKET)
-        self.ws.send(json.dumps({
-            "jsonrpc": "2.0",
-            "id": 3,
-            "method": "srvWebSocketAuth",
-            "params": {
-                "varName": username,
-                "apiKey": self.session.api_key,
-            },
-        }))
+        self.refresh()
+
+        # Replies are JSON, which gets validated on parse anyway, so skip the per-frame UTF-8 scan.
+        self.ws = websocket.create_connection(self.API_URL_SOCKET,
+                                              skip_utf8_validation=True,
+                                              enable_multithread=False,
+                                              timeout=self.SOCKET_TIMEOUT)
+        self.ws.send(_WS_AUTH_TEMPLATE % (_dumps(username), _dumps(self.session.api_key)))
         try:
-            ws_auth = json.loads(self.ws.recv())
+            ws_auth = _json.loads(self.ws.recv())
             if not ws_auth:
                 raise ValueError("no socket auth returned")
             params = ws_auth.get("params")
@@ -385,12 +466,16 @@ class Client(object):
             raise
 
     def _send_request(self, path, data=None):
+        return _Response.from_url_resp(self._request(path, data=data))
+
+    def _request(self, path, data=None):
+        """Send a request over the connection pool and return the raw urllib3 response."""
         if not path.startswith("/"):
             path = "/" + path
 
         data_str = None
         if data:
-            data_str = json.dumps(data)
+            data_str = _dumps(data)
 
         headers = {
             "x-tc-transform": "tti-app",
@@ -400,15 +485,27 @@ class Client(object):
             headers["Content-Length"] = str(len(data_str))
         else:
             headers["x-tc-transformversion"] = "0.2"
+        if self._cookie_header:
+            headers["Cookie"] = self._cookie_header
 
-        req = urllib2.Request(self.API_URL_PREFIX + path, data=data_str, headers=headers)
-        return _Response.from_url_resp(self._opener.open(req))
+        return self._pool.urlopen(
+            method="POST" if data_str else "GET",
+            url=self.API_PATH_PREFIX + path,
+            body=data_str,
+            headers=headers,
+            retries=urllib3.Retry(3, backoff_factor=0.2),
+            preload_content=True)
 
     def _login(self, username, password):
-        resp = self._send_request("/login", data={
+        raw_resp = self._request("/login", data={
             "username": username,
             "password": password,
         })
+        # Only the session cookie matters, so keep just the first name=value pair.
+        set_cookie = raw_resp.headers.get("Set-Cookie")
+        if set_cookie:
+            self._cookie_header = set_cookie.split(";", 1)[0].strip()
+        resp = _Response.from_url_resp(raw_resp)
         if resp.error:
             raise ResponseError("login failed", resp)
         data = resp.data["result"]
@@ -417,34 +514,76 @@ class Client(object):
     def close(self):
         """Close both the HTTPS and WSS connections."""
         self.ws.close()
-        resp = self._send_request("/logout")
-        if resp.error:
-            raise ResponseError("logout failed", resp)
+        try:
+            resp = self._send_request("/logout")
+            if resp.error:
+                raise ResponseError("logout failed", resp)
+        finally:
+            self._pool.close()
         return True
 
+    def refresh(self):
+        """Reload device details, e.g., for current status, reusing the existing session."""
+        self.devices = self._devices()
+
+        self.master = None
+        for d in self.devices:
+            if d.master is not None:
+                self.master = d.master
+                break
+
+        if not self.master:
+            raise ValueError("couldn't find master unit")
+
     def _devices(self):
         resp = self._send_request("/devices")
         if resp.error:
             raise ResponseError("devices request failed", resp)
         meta = resp.data["result"]
+        if not meta:
+            return []
+
+        # Details requests are independent, so fetch them concurrently over the pool.
+        workers = min(self.MAX_CONNECTIONS, len(meta))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            dresps = list(ex.map(lambda d: self._send_request("/devices/" + d["varName"]), meta))
 
         devices = []
-        for device in meta:
-            name = device["varName"]
-            dresp = self._send_request("/devices/" + name)
+        for device, dresp in zip(meta, dresps):
             if dresp.error:
-                raise ResponseError("device request failed for {}".format(name), resp)
+                raise ResponseError("device request failed for {}".format(device["varName"]), dresp)
             # TODO: can there ever be more than one?
             devices.append(Device(meta=device, data=dresp.data["result"][0]))
         return devices
 
+    def _drain(self):
+        """Discard frames already waiting on the web socket, such as push notifications.
+
+        Raises a websocket exception if the socket has been closed.
+        """
+        sock = self.ws.sock
+        if sock is None or not self.ws.connected:
+            raise websocket.WebSocketConnectionClosedException("socket is already closed")
+        # TLS may hold decrypted data that select can't see, so check pending() too.
+        while sock.pending() or select.select([sock], [], [], 0)[0]:
+            self.ws.recv()
+
     def send_command(self, cmd):
         """Send a comand to the unit for a particular device.
 
-        Use the Device command functions to generate appropriate commands.
+        Use the Device command functions to generate appropriate commands. These
+        are already serialized; a dict is also accepted and serialized here.
+
+        The reply is taken to be the next frame after the command. Frames that arrived
+        earlier are discarded first, but one pushed between the command and its reply
+        would still be returned in its place, so replies are best-effort.
         """
-        self.ws.send(json.dumps(cmd))
-        return json.loads(self.ws.recv())
+        if not isinstance(cmd, bytes):
+            cmd = _dumps(cmd)
+        self._drain()
+        # One already-assembled frame; websocket-client writes it straight to the socket.
+        self.ws.send(cmd)
+        return _json.loads(self.ws.recv())
 
     @property
     def api_key(self):
@@ -452,7 +591,217 @@ class Client(object):
 
     @property
     def tz_offset(self):
-        return self.master.maybe("timeZoneOffset", "value")
+        return self.master._v("timeZoneOffset")
+
+# Default Unix socket path for daemon mode.
+DEFAULT_SOCKET_PATH = os.path.expanduser("~/.greendo.sock")
+
+# Arguments that only matter to the invoking process and are not forwarded to a daemon.
+_LOCAL_ARGS = ("email", "pwd", "daemon", "sock")
+
+# Seconds the daemon waits on a connected invocation to send its request or take the reply.
+_DAEMON_IO_TIMEOUT = 10
+
+# Seconds an invocation waits for the daemon's reply. This covers a refresh or a fresh login
+# plus a command's web socket reply.
+_FORWARD_TIMEOUT = 4 * Client.SOCKET_TIMEOUT
+
+# Failures that mean the daemon's session or web socket has gone stale.
+_RECONNECT_ERRORS = (ResponseError, websocket.WebSocketException, urllib3.exceptions.HTTPError, OSError)
+
+def _recv_all(sock):
+    """Read from a socket until the peer shuts down its end."""
+    chunks = []
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+def _forward(path, args):
+    """Send a command to a running daemon and return its reply, or None if no daemon is listening.
+
+    The reply is a dict with "output" text and, if the command failed, an "error" message.
+    """
+    req = {k: v for k, v in vars(args).items() if k not in _LOCAL_ARGS}
+    with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
+        sock.settimeout(_FORWARD_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError:
+            return None
+        try:
+            sock.sendall(_dumps(req))
+            sock.shutdown(socket.SHUT_WR)
+            return _json.loads(_recv_all(sock))
+        except socket.timeout:
+            # The daemon may still run the command, so don't fall back to running it here too.
+            return {"output": "", "error": "no reply from the daemon on {} within {} seconds".format(
+                path, _FORWARD_TIMEOUT)}
+
+def _claim_socket_path(path):
+    """Remove a stale daemon socket at path, so a new daemon can bind there.
+
+    Raises:
+        ValueError: path exists but is not a socket, or another daemon is listening on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError("{} exists and is not a socket".format(path))
+    with closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise ValueError("a daemon is already listening on {}".format(path))
+
+class _Daemon(object):
+    """Holds the daemon's client, logging in again when its session or web socket goes stale.
+
+    Attributes:
+        client: The current logged-in Client.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self.client = connect()
+
+    def run(self, args, out):
+        """Run one forwarded command, logging in again first if the connection has gone stale.
+
+        Only the checks made before the command is sent are retried. A failure after a command
+        has gone out is reported, never resent, so a door command can't run twice.
+        """
+        try:
+            self._prepare(args)
+        except _RECONNECT_ERRORS:
+            self.close()
+            self.client = self._connect()
+            self._prepare(args)
+        _run_cmd(self.client, args, out)
+
+    def _prepare(self, args):
+        if args.target == "status":
+            # Device details were fetched at login, so get current status first.
+            self.client.refresh()
+        else:
+            # Surfaces a web socket the server has closed, before anything is sent on it.
+            self.client._drain()
+
+    def close(self):
+        """Close the client, ignoring errors from a session that is already gone."""
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+def _serve(connect, path):
+    """Run commands sent by other invocations over a Unix socket, until interrupted.
+
+    Each connection carries one JSON-encoded set of command arguments, and receives a
+    JSON reply with the command's output and, on failure, an error message.
+
+    Args:
+        connect: Called with no arguments to log in and return a new Client.
+        path: The Unix socket path to listen on.
+    """
+    daemon = _Daemon(connect)
+    with closing(daemon), closing(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)) as srv:
+        # The daemon holds a logged-in session, so only this user may connect.
+        old_umask = os.umask(0o177)
+        try:
+            srv.bind(path)
+        finally:
+            os.umask(old_umask)
+        srv.listen(1)
+        print("Serving on {}".format(path))
+        try:
+            while True:
+                conn, _ = srv.accept()
+                with closing(conn):
+                    # Don't let one stalled invocation hold up everyone else.
+                    conn.settimeout(_DAEMON_IO_TIMEOUT)
+                    try:
+                        req = _recv_all(conn)
+                    except OSError:
+                        continue
+                    out = io.StringIO()
+                    reply = {}
+                    try:
+                        daemon.run(argparse.Namespace(**_json.loads(req)), out)
+                    except Exception as e:
+                        reply["error"] = "{}: {}".format(type(e).__name__, e)
+                    reply["output"] = out.getvalue()
+                    try:
+                        conn.sendall(_dumps(reply))
+                    except OSError:
+                        pass
+        finally:
+            os.unlink(path)
+
+def _run_cmd(client, args, out=None):
+    """Run the command described by parsed CLI args, writing its output to out (default stdout)."""
+    device = client.devices[_clamp(args.dev, 0, len(client.devices) - 1)]
+    cmd = None
+    if args.target == "status":
+        thing = args.thing
+        if thing == "config":
+            print("Session:\n", json.dumps(client.session.data, indent=2), file=out)
+            print("Devices:\n", json.dumps([{"meta": d.meta, "data": d.data} for d in client.devices], indent=2), file=out)
+        elif thing == "charger":
+            print(json.dumps({
+                "level": device.charger.level()
+            }, indent=2), file=out)
+        elif thing == "door":
+            print(json.dumps(device.door._snapshot(), indent=2), file=out)
+        elif thing == "light":
+            light = device.light
+            print(json.dumps({
+                "light": light.on(),
+                "timer": light.timer(),
+            }, indent=2), file=out)
+        elif thing == "fan":
+            print(json.dumps({
+                "speed": device.fan.speed(),
+            }, indent=2), file=out)
+        return
+
+    if args.target == "door":
+        if args.cmd == "open":
+            cmd = device.cmd_open()
+        elif args.cmd == "close":
+            cmd = device.cmd_close()
+        else:
+            cmd = device.cmd_preset()
+    elif args.target == "motion":
+        cmd = device.cmd_motion(args.set == "on")
+    elif args.target == "light":
+        cmd = device.cmd_light(args.set == "on")
+    elif args.target == "lighttimer":
+        cmd = device.cmd_light_timer(max(0, args.minutes))
+    elif args.target == "fan":
+        cmd = device.cmd_fan(_clamp(args.speed, 0, 100))
+    elif args.target == "vacation":
+        cmd = device.cmd_vacation(args.set == "on")
+    elif args.target == "preset":
+        # max_pos() is None if the door doesn't report it; then only the lower bound applies.
+        cmd = device.cmd_preset_pos(_clamp(args.inches, 0, device.door.max_pos()))
+
+    if args.dry:
+        print("Dry Run:", file=out)
+        print(json.dumps(json.loads(cmd), indent=2), file=out)
+        return
+
+    print("Request to {}:".format(client.API_URL_SOCKET), file=out)
+    print(json.dumps(json.loads(cmd), indent=2), file=out)
+
+    result = client.send_command(cmd)
+    print("Response:", file=out)
+    print(json.dumps(result, indent=2), file=out)
 
 def main():
     ap = argparse.ArgumentParser(prog="greendo")
@@ -460,6 +809,11 @@ def main():
     ap.add_argument("--pwd", "-p", type=str, help="Password for the registered email. Default: request from stdin.")
     ap.add_argument("--dry", "-n", action="store_true", help="Dry run - don't execute commands, just display them")
     ap.add_argument("--dev", "-d", type=int, default=0, help="Door opener device index, if you have more than one.")
+    ap.add_argument("--daemon", action="store_true",
+                    help="Log in once and serve commands from other invocations over a Unix socket until interrupted.")
+    ap.add_argument("--sock", type=str, default=DEFAULT_SOCKET_PATH,
+                    help=("Unix socket path used by --daemon, and tried first by commands unless --email or --pwd "
+                          "is given. Default: %(default)s"))
     sub_ap = ap.add_subparsers(dest="target", help="Commands")
 
     ap_status = sub_ap.add_parser("status", help="Output status for a given subsystem.")
@@ -488,83 +842,40 @@ def main():
     ap_preset_pos.add_argument("inches", type=int)
 
     args = ap.parse_args()
+    if args.daemon:
+        try:
+            _claim_socket_path(args.sock)
+        except ValueError as e:
+            ap.error(str(e))
+    else:
+        if args.target is None:
+            ap.error("a command is required")
+        # Explicit credentials may name a different account than the daemon's, so log in directly.
+        reply = None
+        if args.email is None and args.pwd is None:
+            reply = _forward(args.sock, args)
+        if reply is not None:
+            print(reply["output"], end="")
+            if reply.get("error"):
+                sys.exit("Error: {}".format(reply["error"]))
+            return
 
     email = args.email
     pwd = args.pwd
     if args.email is None:
-        email = raw_input("email: ").strip()
+        email = input("email: ").strip()
     if args.pwd is None:
         pwd = getpass("password: ").strip()
 
-    with closing(Client(email, pwd)) as client:
-        device = client.devices[max(0, min(args.dev, len(client.devices)))]
-        cmd = None
-        if args.target == "status":
-            thing = args.thing
-            if thing == "config":
-                print("Session:\n", json.dumps(client.session.data, indent=2))
-                print("Devices:\n", json.dumps([{"meta": d.meta, "data": d.data} for d in client.devices], indent=2))
-            elif thing == "charger":
-                print(json.dumps({
-                    "level": device.charger.level()
-                }, indent=2))
-            elif thing == "door":
-                door = device.door
-                print(json.dumps({
-                    "status": door.door_status(),
-                    "error": door.door_error(),
-                    "pos": door.door_pos(),
-                    "max": door.door_max(),
-                    "preset": door.preset_pos(),
-                    "motion": door.motion(),
-                    "alarm": door.alarm(),
-                    "motor": door.motor(),
-                    "sensor": door.sensor(),
-                    "vacation": door.vacation(),
-                }, indent=2))
-            elif thing == "light":
-                light = device.light
-                print(json.dumps({
-                    "light": light.on(),
-                    "timer": light.timer(),
-                }, indent=2))
-            elif thing == "fan":
-                print(json.dumps({
-                    "speed": device.fan.speed(),
-                }, indent=2))
-            return
-
-        if args.target == "door":
-            if args.cmd == "open":
-                cmd = device.cmd_open()
-            elif args.cmd == "close":
-                cmd = device.cmd_close()
-            else:
-                cmd = device.cmd_preset()
-        elif args.target == "motion":
-            cmd = device.cmd_motion(args.set == "on")
-        elif args.target == "light":
-            cmd = device.cmd_light(args.set == "on")
-        elif args.target == "lighttimer":
-            cmd = device.cmd_lighttimer(max(0, args.minutes))
-        elif args.target == "fan":
-            cmd = device.cmd_fan(max(0, min(100, args.speed)))
-        elif args.target == "vacation":
-            cmd = device.cmd_vacation(args.set == "on")
-        elif args.target == "preset":
-            cmd = device.cmd_preset(max(0, args.inches))
-
-        if args.dry:
-            print("Dry Run:")
-            print(json.dumps(cmd, indent=2))
-            return
-
-        print("Request to {}:".format(client.API_URL_SOCKET))
-        print(json.dumps(cmd, indent=2))
+    if args.daemon:
+        try:
+            _serve(lambda: Client(email, pwd), args.sock)
+        except KeyboardInterrupt:
+            pass
+        return
 
-        result = client.send_command(cmd)
-        print("Response:")
-        print(json.dumps(result, indent=2))
+    with closing(Client(email, pwd)) as client:
+        _run_cmd(client, args)
 
 if __name__ == '__main__':
     main()